@@ -1,6 +1,6 @@
 import csv
-import json
 import os
+import orjson
 
 def process_api_keys():
     """
@@ -9,20 +9,16 @@ def process_api_keys():
     """
     csv_file = 'cart_277693380_1.csv'
     json_file = 'api_keys.json'
-    api_keys = []
 
     try:
-        with open(csv_file, 'r', encoding='utf-8-sig') as f:
+        with open(csv_file, 'r', newline='', encoding='utf-8-sig') as f:
             reader = csv.reader(f)
             next(reader)  # Skip header row
-            for row in reader:
-                if row:
-                    # Assuming the API key is in the second column (index 1)
-                    api_key = row
-                    api_keys.append({"key": api_key, "token_usage": 0})
+            # The API key is in the second column (index 1)
+            api_keys = [{"key": row[1], "usage": {}} for row in reader if row]
 
-        with open(json_file, 'w') as f:
-            json.dump(api_keys, f, indent=4)
+        with open(json_file, 'wb') as f:
+            f.write(orjson.dumps(api_keys, option=orjson.OPT_INDENT_2))
 
         print(f"Successfully created {json_file}")
 
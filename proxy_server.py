@@ -1,146 +1,466 @@
-import json
+import sys
+
+# Режим gevent (python proxy_server.py --gevent): патчим стандартную библиотеку до остальных импортов,
+# чтобы requests, time.sleep и threading стали кооперативными
+USE_GEVENT = __name__ == '__main__' and '--gevent' in sys.argv
+if USE_GEVENT:
+    from gevent import monkey
+    monkey.patch_all()
+
+import copy
+import html
 import time
+import secrets
 import random
-import string
+import re
 import threading
+from collections import deque
 from flask import Flask, request, jsonify, Response
+from flask.json.provider import JSONProvider
 import requests
-import google.generativeai as genai
+from requests.adapters import HTTPAdapter
+import orjson
 from datetime import datetime, timedelta
-import pytz
+from zoneinfo import ZoneInfo
+from waitress import serve
 import os
+import signal
+import atexit
 
 # --- Configuration Constants ---
 PORT = 8080
+SERVER_THREADS = 32
+UPSTREAM_POOL_SIZE = 128  # не меньше числа одновременных запросов (потоков waitress или соединений gevent)
 API_KEYS_FILE = 'api_keys.json'
 MAX_RETRIES = 3
-RETRY_DELAY_SECONDS = 3
+RETRY_BASE_DELAY_SECONDS = 1
+RETRY_MAX_DELAY_SECONDS = 30
+UPSTREAM_TIMEOUT_SECONDS = (10, 300)  # (подключение, ожидание ответа)
+FLUSH_INTERVAL_SECONDS = 1
+TUI_REFRESH_SECONDS = 1
+RESET_CHECK_INTERVAL_SECONDS = 60
 TARGET_TIMEZONE = 'America/Los_Angeles'
+TARGET_TZ = ZoneInfo(TARGET_TIMEZONE)
+GEMINI_URL_TEMPLATE = "https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent"
+GEMINI_STREAM_URL_TEMPLATE = "https://generativelanguage.googleapis.com/v1beta/models/{model_name}:streamGenerateContent?alt=sse"
+JSON_HEADERS = {'Content-Type': 'application/json'}
+# Заголовки ответа Gemini, которые не пересылаются клиенту: тело уже распаковано requests,
+# а длину и параметры соединения выставляет наш WSGI-сервер
+EXCLUDED_RESPONSE_HEADERS = frozenset({
+    'transfer-encoding', 'content-encoding', 'content-length', 'connection', 'keep-alive',
+})
+# retryDelay из RetryInfo и quotaId из QuotaFailure; кавычки могут быть экранированы,
+# если JSON ошибки вложен в строку message
+RETRY_DELAY_PATTERN = re.compile(rb'"retryDelay\\?"\s*:\s*\\?"(\d+(?:\.\d+)?)s')
+DAILY_QUOTA_PATTERN = re.compile(rb'"quotaId\\?"\s*:\s*\\?"[^"\\]*PerDay')
+DATA_URL_PATTERN = re.compile(r'data:([\w.+-]+/[\w.+-]+);base64,(.+)', re.DOTALL)
+GEMINI_ROLES = {'assistant': 'model'}  # остальные роли OpenAI передаются как 'user'
 SUPPORTED_MODELS = [
     "gemini-2.5-pro",
     "gemini-2.5-flash",
     "gemini-2.0-flash",
 ]
+SUPPORTED_MODEL_SET = frozenset(SUPPORTED_MODELS)
+# Лимиты запросов в минуту (RPM) на один ключ по умолчанию, например {"gemini-2.5-pro": 5} для Free Tier.
+# Пусто: ограничение выключено. Для отдельного ключа лимиты задаются полем "rpm_limits" в api_keys.json
+MODEL_RPM_LIMITS = {}
+RPM_PERIOD_SECONDS = 60
+
+# Список моделей не меняется во время работы, поэтому ответ /v1/models сериализуется один раз
+MODELS_RESPONSE_BODY = orjson.dumps({
+    "object": "list",
+    "data": [
+        {
+            "id": model_id,
+            "object": "model",
+            "created": int(time.time()),
+            "owned_by": "google"
+        } for model_id in SUPPORTED_MODELS
+    ]
+})
+# Клиенты могут кэшировать список моделей, а не запрашивать его заново
+MODELS_RESPONSE_HEADERS = {'Cache-Control': 'public, max-age=3600'}
+
+# Статичные части HTML-страницы статуса
+STATUS_PAGE_HEADER = """
+    <html>
+    <head>
+        <title>Gemini API Proxy Status</title>
+        <style>
+            body { font-family: Arial, sans-serif; margin: 2em; background-color: #f4f4f9; color: #333; }
+            h1, h2 { color: #444; }
+            .key-block { background-color: #fff; border: 1px solid #ddd; border-radius: 5px; padding: 1em; margin-bottom: 1em; }
+            .model-info { margin-left: 2em; }
+            .rpd-ok { color: green; }
+            .rpd-reached { color: red; }
+        </style>
+    </head>
+    <body>
+        <h1>Gemini API Proxy Status</h1>
+"""
+STATUS_PAGE_MODEL_TEMPLATE = """
+                    <div class="model-info">
+                        <p><strong>Model:</strong> {model_name}</p>
+                        <p>Tokens: {token_count}</p>
+                        <p>Cached Tokens: {cached_token_count}</p>
+                        <p>Requests: {request_count}</p>
+                        <p>RPD Status: <span class="{rpd_class}">{rpd_status}</span></p>
+                    </div>
+"""
 
 # --- Global Variables & Locks ---
 api_keys = []
+available_keys = {}  # model_name -> deque индексов ключей, не достигших RPD лимита
 key_lock = threading.Lock()
-file_lock = threading.Lock()
+file_lock = threading.RLock()
+keys_dirty = threading.Event()
+shutdown_event = threading.Event()
+state_version = 0  # увеличивается при каждом изменении api_keys
+
+# Общий пул соединений к Gemini: TCP/TLS соединения переиспользуются между запросами.
+# Размер пула должен покрывать все одновременные запросы, иначе лишние соединения не переиспользуются.
+# Повторы выполняются нашим собственным циклом, поэтому встроенные повторы urllib3 отключены.
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=UPSTREAM_POOL_SIZE, max_retries=0))
+
+class OrjsonProvider(JSONProvider):
+    """
+    Flask JSON provider backed by orjson, used by jsonify and request.get_json.
+    """
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+class RateLimiter:
+    """
+    Sliding-window limiter allowing at most max_calls acquisitions per period seconds.
+    Used per key and model to stay under Gemini's RPM limit instead of waiting for a 429.
+    """
+    def __init__(self, max_calls, period):
+        self.max_calls = max_calls
+        self.period = period
+        self.calls = deque()  # время (time.monotonic) последних вызовов acquire
+        self.condition = threading.Condition()
+
+    def try_acquire(self):
+        """
+        Records a call and returns True if one is allowed in the current window; returns False otherwise without waiting.
+        """
+        with self.condition:
+            return self.record_call(time.monotonic())
+
+    def acquire(self):
+        """
+        Blocks until a call is allowed in the current window, then records it.
+        """
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if self.record_call(now):
+                    return
+                # Ждем, пока самый старый вызов выйдет из окна; блокировка на время ожидания отпускается
+                self.condition.wait(self.period - (now - self.calls[0]))
+
+    def record_call(self, now):
+        """
+        Drops calls that left the window and records a new one if there is room.
+        Must be called with the condition held.
+        """
+        while self.calls and now - self.calls[0] >= self.period:
+            self.calls.popleft()
+        if len(self.calls) < self.max_calls:
+            self.calls.append(now)
+            return True
+        return False
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # --- Helper Functions: File & Key Management ---
 
 def load_api_keys():
     """
     Loads API keys from the specified JSON file.
+    Each key gets its own '_lock' guarding its usage data, the extracted '_api_key' string,
+    prebuilt request '_headers' and per-model '_rate_limiters'; fields starting with '_' are never saved.
+    Usage entries for all SUPPORTED_MODELS are created up front, so request handling only reads them.
     """
     try:
-        with open(API_KEYS_FILE, 'r') as f:
-            return json.load(f)
+        with open(API_KEYS_FILE, 'rb') as f:
+            keys = orjson.loads(f.read())
+        for key_info in keys:
+            key_info['_lock'] = threading.Lock()
+            key_info['_api_key'] = extract_api_key(key_info['key'])
+            key_info['_headers'] = {'x-goog-api-key': key_info['_api_key']}
+            # Лимиты ключа из файла дополняют и переопределяют MODEL_RPM_LIMITS; 0 выключает ограничение
+            rpm_limits = {**MODEL_RPM_LIMITS, **key_info.get('rpm_limits', {})}
+            key_info['_rate_limiters'] = {
+                model_name: RateLimiter(rpm_limit, RPM_PERIOD_SECONDS)
+                for model_name, rpm_limit in rpm_limits.items() if rpm_limit > 0
+            }
+            usage_data = key_info.setdefault('usage', {})
+            for model_name in SUPPORTED_MODELS:
+                usage_data.setdefault(model_name, new_model_usage())
+            # Дополняем записи из старых файлов недостающими полями
+            for model_usage in usage_data.values():
+                for field, default in new_model_usage().items():
+                    model_usage.setdefault(field, default)
+        return keys
     except FileNotFoundError:
         app.logger.error(f"Ошибка: файл '{API_KEYS_FILE}' не найден.")
-    except (ValueError, KeyError, IndexError) as e:
+    except (ValueError, KeyError, IndexError, TypeError) as e:
         app.logger.error(f"Ошибка при чтении или обработке '{API_KEYS_FILE}': {e}")
     return []
 
+def extract_api_key(api_key_data):
+    """
+    Returns the API key string from the 'key' field of a key entry, supporting older file formats.
+    """
+    if isinstance(api_key_data, dict):
+        # Обработка старого формата, где ключ находится внутри вложенной структуры
+        return api_key_data.get('key', [None, None])[1]
+    if isinstance(api_key_data, list):
+        # Старый process_keys.py сохранял всю строку CSV, ключ во второй колонке
+        return api_key_data[1]
+    # Обработка нового формата, где ключ является простой строкой
+    return api_key_data
+
+def new_model_usage():
+    """
+    Returns a fresh usage entry for a single model.
+    """
+    return {'token_count': 0, 'cached_token_count': 0, 'request_count': 0, 'rpd_limit_reached': False}
+
 def save_api_keys():
     """
     Saves the current state of api_keys to the JSON file.
+    The data goes to a temporary file first and is swapped in with os.replace,
+    so a crash mid-write never leaves a truncated keys file behind.
+    Key locks are held only while copying the state; encoding and disk I/O happen outside them.
+    file_lock covers the whole save, so a later snapshot is never overwritten by an earlier one.
     """
+    tmp_file = API_KEYS_FILE + '.tmp'
     with file_lock:
-        with open(API_KEYS_FILE, 'w') as f:
-            json.dump(api_keys, f, indent=4)
+        # Сбрасываем флаг до снимка, чтобы изменения во время записи не потерялись
+        keys_dirty.clear()
+        data = orjson.dumps(snapshot_api_keys())
+        with open(tmp_file, 'wb', buffering=65536) as f:
+            f.write(data)
+        os.replace(tmp_file, API_KEYS_FILE)
+
+def snapshot_api_keys():
+    """
+    Returns a deep copy of api_keys without runtime-only fields (names starting with '_').
+    Each key is copied under its own lock. Must not be called with key_lock or a key lock held.
+    """
+    with key_lock:
+        keys = list(api_keys)
+    snapshot = []
+    for key_info in keys:
+        with key_info['_lock']:
+            snapshot.append({k: copy.deepcopy(v) for k, v in key_info.items() if not k.startswith('_')})
+    return snapshot
+
+def get_available_keys(model_name):
+    """
+    Returns the round-robin deque of key indices that have not reached the RPD limit
+    for the given model, building it from api_keys on first use.
+    Must be called with key_lock held.
+    """
+    model_keys = available_keys.get(model_name)
+    if model_keys is None:
+        model_keys = deque(
+            i for i, key_info in enumerate(api_keys)
+            if not key_info['usage'].get(model_name, {}).get('rpd_limit_reached', False)
+        )
+        available_keys[model_name] = model_keys
+    return model_keys
+
+def mark_state_changed():
+    """
+    Records that api_keys changed: schedules a save and lets the TUI know it needs a redraw.
+    """
+    global state_version
+    state_version += 1
+    keys_dirty.set()
+
+def persist_api_keys_periodically():
+    """
+    Writes api_keys to disk at most once per FLUSH_INTERVAL_SECONDS when they have changed.
+    Request handlers only set keys_dirty, so many updates are coalesced into one write.
+    This function is intended to be run in a background thread.
+    A failed write is logged and retried on the next interval instead of stopping the thread.
+    """
+    while True:
+        keys_dirty.wait()
+        time.sleep(FLUSH_INTERVAL_SECONDS)
+        try:
+            save_api_keys()
+        except OSError as e:
+            app.logger.error(f"Ошибка при сохранении '{API_KEYS_FILE}': {e}")
+            # save_api_keys сбросил флаг до записи, поэтому восстанавливаем его, чтобы повторить сохранение
+            keys_dirty.set()
+
+def flush_api_keys():
+    """
+    Immediately writes pending changes to disk. Registered with atexit on startup.
+    Waits for a save already started by the background thread before checking keys_dirty.
+    """
+    with file_lock:
+        if keys_dirty.is_set():
+            save_api_keys()
+
+def next_midnight(now):
+    """
+    Returns the midnight following the given time in TARGET_TIMEZONE.
+    """
+    return datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=TARGET_TZ)
 
 def reset_rpd_limits_daily():
     """
     Resets RPD (Requests Per Day) limits for all models on all keys at midnight.
-    This function is intended to be run in a background thread.
+    This function is intended to be run in a background thread; it returns once shutdown_event is set.
     """
-    pt_timezone = pytz.timezone(TARGET_TIMEZONE)
+    reset_at = next_midnight(datetime.now(TARGET_TZ))
     while True:
-        now_pt = datetime.now(pt_timezone)
-        tomorrow_pt = (now_pt + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-        sleep_seconds = (tomorrow_pt - now_pt).total_seconds()
-        
-        app.logger.info(f"Сброс RPD лимитов произойдет через {sleep_seconds:.2f} секунд.")
-        time.sleep(sleep_seconds)
+        # Считаем через timestamp: разность aware-datetime в одной зоне не учитывает переход на летнее время
+        app.logger.info(f"Сброс RPD лимитов произойдет через {max(0.0, reset_at.timestamp() - time.time()):.2f} секунд.")
+        # Ждем отрезками не длиннее RESET_CHECK_INTERVAL_SECONDS и каждый раз сверяемся с настенными часами:
+        # таймаут wait идет по монотонным часам, которые не учитывают сон машины и перевод системного времени
+        while (sleep_seconds := reset_at.timestamp() - time.time()) > 0:
+            if shutdown_event.wait(min(sleep_seconds, RESET_CHECK_INTERVAL_SECONDS)):
+                return
         
+        for key_info in api_keys:
+            with key_info['_lock']:
+                for model_usage in key_info['usage'].values():
+                    model_usage['rpd_limit_reached'] = False
+                    model_usage['request_count'] = 0
         with key_lock:
-            for key_info in api_keys:
-                if 'usage' in key_info:
-                    for model_name in key_info['usage']:
-                        key_info['usage'][model_name]['rpd_limit_reached'] = False
-                        key_info['usage'][model_name]['request_count'] = 0
-            save_api_keys()
-            app.logger.info("RPD лимиты и счетчики запросов сброшены для всех ключей и моделей.")
-        
-        time.sleep(1) # Avoid resetting multiple times in the same second
+            # Очереди доступных ключей будут заново построены при следующих запросах
+            available_keys.clear()
+        mark_state_changed()
+        app.logger.info("RPD лимиты и счетчики запросов сброшены для всех ключей и моделей.")
+
+        # Отсчитываем от уже прошедшей полуночи, чтобы ранний выход из ожидания не вызвал повторный сброс
+        reset_at = next_midnight(max(datetime.now(TARGET_TZ), reset_at))
 
 def print_status_tui():
     """
     Prints a simple Text-based User Interface with the current status.
+    Works on a snapshot so no locks are held while printing; the whole screen is written at once.
     """
-    os.system('cls' if os.name == 'nt' else 'clear')
-    print("--- Gemini API Proxy Server ---")
-    print(f"Статус: {'Работает' if api_keys else 'Ошибка'}")
-    print(f"Порт: {PORT}")
-    print(f"Загружено ключей: {len(api_keys)}")
-    print("-----------------------------")
-    if api_keys:
-        for i, key_info in enumerate(api_keys):
-            print(f"  - Ключ {i+1}:")
-            if 'usage' in key_info:
-                for model, usage in key_info['usage'].items():
-                    limit_status = "ДОСТИГНУТ" if usage.get('rpd_limit_reached', False) else "OK"
-                    print(f"    - Модель: {model}")
-                    print(f"      Токены: {usage.get('token_count', 0)}")
-                    print(f"      Запросы: {usage.get('request_count', 0)}")
-                    print(f"      Лимит RPD: {limit_status}")
-            else:
-                print("    - Данные об использовании отсутствуют.")
-    print("-----------------------------")
+    snapshot = snapshot_api_keys()
+    # Очищаем экран ANSI-последовательностью вместо запуска cls/clear в отдельном процессе
+    lines = [
+        "\x1b[2J\x1b[H--- Gemini API Proxy Server ---",
+        f"Статус: {'Работает' if snapshot else 'Ошибка'}",
+        f"Порт: {PORT}",
+        f"Загружено ключей: {len(snapshot)}",
+        "-----------------------------",
+    ]
+    for i, key_info in enumerate(snapshot):
+        lines.append(f"  - Ключ {i+1}:")
+        if 'usage' in key_info:
+            for model, usage in key_info['usage'].items():
+                limit_status = "ДОСТИГНУТ" if usage.get('rpd_limit_reached', False) else "OK"
+                lines.append(f"    - Модель: {model}")
+                lines.append(f"      Токены: {usage.get('token_count', 0)}")
+                lines.append(f"      Из кэша: {usage.get('cached_token_count', 0)}")
+                lines.append(f"      Запросы: {usage.get('request_count', 0)}")
+                lines.append(f"      Лимит RPD: {limit_status}")
+        else:
+            lines.append("    - Данные об использовании отсутствуют.")
+    lines.append("-----------------------------\n")
+    # Один вызов write вместо print на каждую строку: экран не мерцает и вывод не перемешивается с логами
+    sys.stdout.write("\n".join(lines))
+    sys.stdout.flush()
+
+def render_status_tui_periodically():
+    """
+    Checks every TUI_REFRESH_SECONDS whether the state changed and redraws the TUI only then,
+    keeping console output off the request path.
+    This function is intended to be run in a background thread; it returns once shutdown_event is set.
+    """
+    rendered_version = state_version
+    while not shutdown_event.wait(TUI_REFRESH_SECONDS):
+        if state_version != rendered_version:
+            rendered_version = state_version
+            print_status_tui()
 
 # --- Helper Functions: Request/Response Conversion ---
 
+def convert_message_content_to_parts(content):
+    """
+    Converts OpenAI message content (a string or a list of content parts) to Gemini parts.
+    Text, images passed as base64 data URLs and input_audio become Gemini parts;
+    any other content raises ValueError instead of being dropped, as does an empty parts list.
+    """
+    if not isinstance(content, list):
+        return [{"text": content or ''}]
+
+    parts = []
+    for part in content:
+        part_type = part.get('type')
+        if part_type == 'text':
+            parts.append({"text": part.get('text', '')})
+        elif part_type == 'image_url':
+            image_url = part.get('image_url')
+            url = image_url.get('url', '') if isinstance(image_url, dict) else image_url or ''
+            # Gemini принимает изображения только inline или из Files API, поэтому внешние URL не поддерживаются
+            data_url_match = DATA_URL_PATTERN.fullmatch(url)
+            if not data_url_match:
+                raise ValueError("Only base64 data URLs (data:<mime>;base64,...) are supported in image_url content parts.")
+            parts.append({"inline_data": {"mime_type": data_url_match.group(1), "data": data_url_match.group(2)}})
+        elif part_type == 'input_audio':
+            input_audio = part.get('input_audio') or {}
+            parts.append({"inline_data": {"mime_type": f"audio/{input_audio.get('format', 'wav')}", "data": input_audio.get('data', '')}})
+        else:
+            raise ValueError(f"Unsupported message content part type: '{part_type}'.")
+    if not parts:
+        raise ValueError("Message content must contain at least one part.")
+    return parts
+
 def convert_openai_to_gemini_request(openai_request):
     """
     Converts an OpenAI-formatted chat completion request to a Gemini-formatted one.
+    Raises ValueError for message content that cannot be sent to Gemini.
+    Messages are walked once; the system prompt is prepended to the first user message as its own part.
     """
-    messages = openai_request.get('messages', [])
     gemini_contents = []
+    append_content = gemini_contents.append
     system_prompt = ""
-    
-    # Сначала найдем системный промпт
-    for message in messages:
-        if message.get('role') == 'system':
-            system_prompt = message.get('content', '') + "\n\n"
-            
-    # Теперь обработаем остальные сообщения
-    for message in messages:
+
+    for message in openai_request.get('messages', []):
         role = message.get('role')
+        parts = convert_message_content_to_parts(message.get('content'))
         if role == 'system':
-            continue # Уже обработали
-        
-        # Преобразуем роли
-        gemini_role = "model" if role == "assistant" else "user"
-        
-        gemini_contents.append({
-            "role": gemini_role,
-            "parts": [{"text": message.get('content', '')}]
-        })
+            if any('text' not in part for part in parts):
+                raise ValueError("System messages may only contain text.")
+            system_prompt = "".join(part['text'] for part in parts) + "\n\n"
+            continue
+
+        append_content({"role": GEMINI_ROLES.get(role, "user"), "parts": parts})
 
     # Добавляем системный промпт к первому сообщению пользователя, если он есть
     if system_prompt and gemini_contents and gemini_contents[0]['role'] == 'user':
-        gemini_contents[0]['parts'][0]['text'] = system_prompt + gemini_contents[0]['parts'][0]['text']
+        gemini_contents[0]['parts'] = [{"text": system_prompt}] + gemini_contents[0]['parts']
 
     return {'contents': gemini_contents}
 
+def generate_completion_id():
+    """
+    Generates an OpenAI-style chat completion ID.
+    """
+    return 'chatcmpl-' + secrets.token_urlsafe(22)
+
 def convert_gemini_to_openai_response(gemini_response_json, model_name):
     """
     Converts a Gemini response to the OpenAI chat completion format.
     """
-    completion_id = 'chatcmpl-' + ''.join(random.choices(string.ascii_letters + string.digits, k=29))
+    completion_id = generate_completion_id()
     created_time = int(time.time())
     choices = []
 
@@ -153,7 +473,12 @@ def convert_gemini_to_openai_response(gemini_response_json, model_name):
                 "finish_reason": candidate.get('finishReason', 'stop')
             })
 
-    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    usage_metadata = gemini_response_json.get('usageMetadata', {})
+    usage = {
+        "prompt_tokens": usage_metadata.get('promptTokenCount', 0),
+        "completion_tokens": usage_metadata.get('candidatesTokenCount', 0),
+        "total_tokens": usage_metadata.get('totalTokenCount', 0)
+    }
 
     return {
         "id": completion_id,
@@ -164,6 +489,33 @@ def convert_gemini_to_openai_response(gemini_response_json, model_name):
         "usage": usage
     }
 
+def generate_openai_stream(gemini_events, model_name):
+    """
+    Converts the (line, chunk) pairs from a GeminiStream into OpenAI chat completion chunks in SSE format.
+    """
+    completion_id = generate_completion_id()
+    created_time = int(time.time())
+
+    for _, gemini_chunk in gemini_events:
+        choices = []
+        for candidate in gemini_chunk.get('candidates', []):
+            content = candidate.get('content', {}).get('parts', [{}])[0].get('text', '')
+            choices.append({
+                "index": candidate.get('index', 0),
+                "delta": {"role": "assistant", "content": content},
+                "finish_reason": candidate.get('finishReason')
+            })
+        openai_chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created_time,
+            "model": model_name,
+            "choices": choices
+        }
+        yield b'data: ' + orjson.dumps(openai_chunk) + b'\n\n'
+
+    yield b'data: [DONE]\n\n'
+
 # --- Helper Functions: Error Handling ---
 
 def handle_rate_limit_error(error_response, key_index, model_name):
@@ -171,241 +523,361 @@ def handle_rate_limit_error(error_response, key_index, model_name):
     Parses a 429 error for retry-after info or identifies it as a daily limit error.
     Returns delay in seconds if retryable, or None if it's a hard limit.
     """
-    try:
-        error_json = error_response.json()
-        error_message_str = error_json.get("error", {}).get("message", "")
-        
-        inner_error_json = json.loads(error_message_str)
-        details = inner_error_json.get("error", {}).get("details", [])
-        
-        retry_info = next((d for d in details if d.get("@type") == "type.googleapis.com/google.rpc.RetryInfo"), None)
-
-        if retry_info and 'retryDelay' in retry_info:
-            delay_str = retry_info['retryDelay'].replace('s', '')
-            delay_seconds = float(delay_str)
-            app.logger.warning(f"Получен статус 429 с retryDelay. Ожидание {delay_seconds} сек...")
-            return delay_seconds
-            
-    except (json.JSONDecodeError, KeyError, TypeError, ValueError) as json_e:
-        app.logger.error(f"Не удалось распарсить retryDelay из ответа 429: {json_e}")
-
-    if "quotaMetric" in error_response.text:
-        app.logger.warning(f"Получен статус 429 (RPD Limit) для ключа #{key_index + 1} и модели '{model_name}'.")
-        with key_lock:
-            # Убедимся, что 'usage' и 'model_name' существуют перед записью
-            usage_data = api_keys[key_index].setdefault('usage', {})
-            model_usage = usage_data.setdefault(model_name, {
-                'token_count': 0, 'request_count': 0, 'rpd_limit_reached': False
-            })
-            model_usage['rpd_limit_reached'] = True
-            save_api_keys()
+    raw_error = error_response.content
+    # Ответы на превышение и минутного, и дневного лимита содержат RetryInfo, поэтому сначала
+    # по quotaId определяем дневной лимит: ждать retryDelay для него бессмысленно
+    if DAILY_QUOTA_PATTERN.search(raw_error):
+        mark_rpd_limit_reached(key_index, model_name)
+        return None
+
+    # Нужно одно число, поэтому вместо разбора JSON (в том числе вложенного в поле message) ищем его регуляркой
+    retry_delay_match = RETRY_DELAY_PATTERN.search(raw_error)
+    if retry_delay_match:
+        delay_seconds = float(retry_delay_match.group(1))
+        app.logger.warning(f"Получен статус 429 с retryDelay. Ожидание {delay_seconds} сек...")
+        return delay_seconds
+
+    # Поиск по сырым байтам, без декодирования ответа в строку
+    if b"quotaMetric" in raw_error:
+        mark_rpd_limit_reached(key_index, model_name)
     
     return None
 
-# --- Flask Endpoints ---
-
-@app.route('/', methods=['GET'])
-def status_page():
+def mark_rpd_limit_reached(key_index, model_name):
     """
-    Generates and returns an HTML page with the real-time status of API key usage.
+    Flags the key as having reached the daily request limit for the model
+    and removes it from the model's round-robin queue until the daily reset.
     """
-    html = """
-    <html>
-    <head>
-        <title>Gemini API Proxy Status</title>
-        <style>
-            body { font-family: Arial, sans-serif; margin: 2em; background-color: #f4f4f9; color: #333; }
-            h1, h2 { color: #444; }
-            .key-block { background-color: #fff; border: 1px solid #ddd; border-radius: 5px; padding: 1em; margin-bottom: 1em; }
-            .model-info { margin-left: 2em; }
-            .rpd-ok { color: green; }
-            .rpd-reached { color: red; }
-        </style>
-    </head>
-    <body>
-        <h1>Gemini API Proxy Status</h1>
-"""
+    app.logger.warning(f"Получен статус 429 (RPD Limit) для ключа #{key_index + 1} и модели '{model_name}'.")
+    key_info = api_keys[key_index]
+    with key_info['_lock']:
+        key_info['usage'][model_name]['rpd_limit_reached'] = True
     with key_lock:
-        html += f"<p><strong>Total Keys Loaded:</strong> {len(api_keys)}</p>"
-        for i, key_info in enumerate(api_keys):
-            html += f'<div class="key-block"><h2>Key #{i+1}</h2>'
-            if not key_info.get('usage'):
-                html += "<p>No usage data yet.</p>"
-            else:
-                for model_name, usage_data in sorted(key_info['usage'].items()):
-                    rpd_status = "Reached" if usage_data.get('rpd_limit_reached', False) else "OK"
-                    rpd_class = "rpd-reached" if usage_data.get('rpd_limit_reached', False) else "rpd-ok"
-                    html += f"""
-                    <div class="model-info">
-                        <p><strong>Model:</strong> {model_name}</p>
-                        <p>Tokens: {usage_data.get('token_count', 0)}</p>
-                        <p>Requests: {usage_data.get('request_count', 0)}</p>
-                        <p>RPD Status: <span class="{rpd_class}">{rpd_status}</span></p>
-                    </div>
-                    """
-            html += '</div>'
-    html += "</body></html>"
-    return html
+        try:
+            available_keys[model_name].remove(key_index)
+        except (KeyError, ValueError):
+            pass  # очередь еще не построена или ключ уже удален другим запросом
+    mark_state_changed()
 
-@app.route('/v1/models', methods=['GET'])
-def list_models():
+# --- Helper Functions: Gemini Forwarding ---
+
+def filter_response_headers(headers):
     """
-    Provides a list of supported models in the OpenAI format.
+    Returns the upstream headers to pass on to the client as a list of (name, value) pairs.
     """
-    model_data = [
-        {
-            "id": model_id,
-            "object": "model",
-            "created": int(time.time()),
-            "owned_by": "google"
-        } for model_id in SUPPORTED_MODELS
-    ]
-    return jsonify({"object": "list", "data": model_data})
+    return [(k, v) for k, v in headers.items() if k.lower() not in EXCLUDED_RESPONSE_HEADERS]
 
-@app.route('/v1/chat/completions', methods=['POST'])
-def chat_completions():
+def get_retry_delay(attempt):
     """
-    Handles OpenAI-compatible chat completion requests.
+    Returns an exponential backoff delay with jitter for the given zero-based attempt,
+    so concurrent requests do not retry in lockstep.
     """
-    openai_request = request.json
-    model_name = openai_request.get('model')
-
-    gemini_request_data = convert_openai_to_gemini_request(openai_request)
-    
-    internal_proxy_url = f"http://127.0.0.1:{PORT}/v1beta/models/{model_name}:generateContent"
-
-    try:
-        response = requests.post(internal_proxy_url, json=gemini_request_data, timeout=300)
-        response.raise_for_status()
-        gemini_response_json = response.json()
-
-        openai_response = convert_gemini_to_openai_response(gemini_response_json, model_name)
-        return jsonify(openai_response)
-
-    except requests.exceptions.RequestException as e:
-        error_message = f"Failed to connect to the internal Gemini proxy: {str(e)}"
-        status_code = 500
-        if e.response is not None:
-            error_message = e.response.text
-            status_code = e.response.status_code
-        app.logger.error(f"Error in chat_completions: {error_message}")
-        return jsonify({"error": error_message}), status_code
+    return min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.5)
 
-@app.route('/v1beta/models/<string:model_name>:generateContent', methods=['POST'])
-def proxy_to_gemini(model_name):
+def record_usage(key_info, model_name, usage_metadata):
     """
-    Proxies requests to the Google Gemini API, handling key rotation, limits, and retries.
+    Adds one request and the tokens from Gemini's usageMetadata to the key's usage for the model.
+    """
+    # Gemini сам сообщает расход токенов, отдельный подсчет не нужен
+    total_tokens = usage_metadata.get('totalTokenCount', 0)
+    cached_tokens = usage_metadata.get('cachedContentTokenCount', 0)
+    # Запись для модели создана при загрузке и не заменяется, поэтому ее можно получить до блокировки
+    model_usage = key_info['usage'][model_name]
+    with key_info['_lock']:
+        model_usage['token_count'] += total_tokens
+        model_usage['cached_token_count'] += cached_tokens
+        model_usage['request_count'] += 1
+    mark_state_changed()
+
+class GeminiStream:
+    """
+    Iterates (raw "data:" line, parsed chunk) pairs of a Gemini SSE response as they arrive,
+    so callers can either relay the line unchanged or convert the chunk.
+    close() releases the upstream connection and records usage from the last reported usageMetadata;
+    routes register it with Response.call_on_close, so it also runs when the client disconnects
+    before the first chunk (an unstarted generator's finally block never runs).
+    """
+    def __init__(self, response, key_info, model_name):
+        self.response = response
+        self.key_info = key_info
+        self.model_name = model_name
+        self.usage_metadata = {}
+
+    def __iter__(self):
+        for line in self.response.iter_lines():
+            # Gemini присылает события в формате "data: {...}"
+            if not line.startswith(b'data:'):
+                continue
+            gemini_chunk = orjson.loads(line[5:])
+            self.usage_metadata = gemini_chunk.get('usageMetadata', self.usage_metadata)
+            yield line, gemini_chunk
+
+    def close(self):
+        """
+        Closes the upstream response and records the request's usage.
+        """
+        self.response.close()
+        record_usage(self.key_info, self.model_name, self.usage_metadata)
+
+def forward_to_gemini(model_name, request_data, stream=False):
+    """
+    Sends a generateContent request to Gemini, rotating keys and retrying on errors.
+    Returns a (content, status_code, headers, response_json) tuple; called directly by both Flask routes.
+    Models outside SUPPORTED_MODELS are rejected with 404 before any key is used.
+    response_json is the already-parsed body of a successful response and None on errors.
+    With stream=True, a successful response's content is a GeminiStream over streamGenerateContent
+    and response_json is None; the caller must make sure its close() is called.
     """
-    request_data = request.get_json()
-
     if not api_keys:
         app.logger.error("API keys are not loaded or missing.")
-        return jsonify({"error": "API ключи не загружены или отсутствуют."}), 500
+        return orjson.dumps({"error": "API ключи не загружены или отсутствуют."}), 500, JSON_HEADERS, None
+
+    if model_name not in SUPPORTED_MODEL_SET:
+        # Неизвестную модель отклоняем сразу, не расходуя запросы всех ключей на заведомую ошибку
+        app.logger.error(f"Unsupported model requested: {model_name}")
+        return orjson.dumps({
+            "error": {
+                "code": 404,
+                "message": f"Not Found: model '{model_name}' is not supported by this proxy. Supported models: {', '.join(SUPPORTED_MODELS)}.",
+                "status": "NOT_FOUND"
+            }
+        }), 404, JSON_HEADERS, None
 
     last_error_response = None
+    # URL не зависит от ключа (он передается в заголовке), поэтому строится один раз на запрос
+    gemini_url = (GEMINI_STREAM_URL_TEMPLATE if stream else GEMINI_URL_TEMPLATE).format(model_name=model_name)
 
-    for key_index, key_info in enumerate(api_keys):
-        with key_lock:
-            usage_data = key_info.setdefault('usage', {})
-            model_usage = usage_data.setdefault(model_name, {
-                'token_count': 0, 'request_count': 0, 'rpd_limit_reached': False
-            })
-            
-            if model_usage.get('rpd_limit_reached', False):
-                app.logger.info(f"Ключ #{key_index + 1} уже достиг RPD лимита для модели '{model_name}'. Пропускаем.")
-                continue
-
-        api_key_data = key_info['key']
-        if isinstance(api_key_data, dict):
-            # Обработка старого формата, где ключ находится внутри вложенной структуры
-            api_key = api_key_data.get('key', [None, None])[1]
-        else:
-            # Обработка нового формата, где ключ является простой строкой
-            api_key = api_key_data
-        gemini_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent"
+    with key_lock:
+        model_keys = get_available_keys(model_name)
+        key_order = list(model_keys)
+        # Следующий запрос начнет со следующего ключа (round-robin)
+        model_keys.rotate(-1)
+
+    # Ключ, у которого исчерпан RPM лимит, откладывается в конец очереди: ждать освобождения слота
+    # приходится, только если ни один из остальных ключей не смог ответить
+    pending_keys = deque((key_index, False) for key_index in key_order)
+    while pending_keys:
+        key_index, wait_for_rate_limit = pending_keys.popleft()
+        key_info = api_keys[key_index]
+        # Чтение без блокировки: записи usage для SUPPORTED_MODELS созданы при загрузке,
+        # а чтение одного значения из dict атомарно под GIL
+        model_usage = key_info['usage'][model_name]
+        if model_usage['rpd_limit_reached']:
+            app.logger.info(f"Ключ #{key_index + 1} уже достиг RPD лимита для модели '{model_name}'. Пропускаем.")
+            continue
+
+        headers = key_info['_headers']
+        rate_limiter = key_info['_rate_limiters'].get(model_name)
         
-        print_status_tui()
         app.logger.info(f"Используется ключ #{key_index + 1} для модели '{model_name}'")
 
         for attempt in range(MAX_RETRIES):
+            if rate_limiter is not None:
+                # Каждая попытка расходует RPM, поэтому лимит проверяется перед каждым запросом
+                if wait_for_rate_limit:
+                    rate_limiter.acquire()
+                elif not rate_limiter.try_acquire():
+                    app.logger.info(f"Ключ #{key_index + 1} достиг RPM лимита для модели '{model_name}'. Откладываем.")
+                    pending_keys.append((key_index, True))
+                    break
             try:
-                headers = {'x-goog-api-key': api_key}
-                response = requests.post(gemini_url, headers=headers, json=request_data)
-
-                if response.status_code == 503 and attempt < MAX_RETRIES - 1:
-                    app.logger.warning(f"Получен статус 503. Повторная попытка через {RETRY_DELAY_SECONDS} сек...")
-                    time.sleep(RETRY_DELAY_SECONDS)
-                    continue
+                response = http_session.post(gemini_url, headers=headers, json=request_data, stream=stream, timeout=UPSTREAM_TIMEOUT_SECONDS)
+            except requests.exceptions.RequestException as e:
+                app.logger.error(f"Ошибка запроса: {e}. Попытка {attempt + 1}/{MAX_RETRIES}")
+                if attempt < MAX_RETRIES - 1:
+                    time.sleep(get_retry_delay(attempt))
+                else:
+                    last_error_response = (orjson.dumps({"error": str(e)}), 500, JSON_HEADERS, None)
+                continue
 
-                response.raise_for_status()
+            # Статус проверяется напрямую, без raise_for_status и перехвата HTTPError
+            status_code = response.status_code
+            if status_code < 400:
+                response_headers = filter_response_headers(response.headers)
+                if stream:
+                    app.logger.info("Начата потоковая передача ответа.")
+                    return GeminiStream(response, key_info, model_name), status_code, response_headers, None
 
-                response_data = response.json()
-                
-                with key_lock:
-                    api_keys[key_index]['usage'][model_name]['request_count'] += 1
-                    save_api_keys()
+                response_data = orjson.loads(response.content)
+                record_usage(key_info, model_name, response_data.get('usageMetadata', {}))
                 
                 app.logger.info(f"Запрос успешен.")
-                print_status_tui()
-
-                # Создаем и возвращаем правильный объект Response
-                headers_dict = {k: v for k, v in response.headers.items() if k.lower() not in ['transfer-encoding', 'content-encoding']}
-                return Response(response.content, status=response.status_code, headers=headers_dict)
-
-            except requests.exceptions.HTTPError as e:
-                if e.response and e.response.status_code == 500:
-                    app.logger.warning(f"Caught 500 Internal Server Error. Retrying in 2 seconds... (Attempt {attempt + 1}/{MAX_RETRIES})")
-                    time.sleep(2)
-                    continue
-
-                if e.response.status_code == 429:
-                    delay = handle_rate_limit_error(e.response, key_index, model_name)
-                    if delay is not None:
-                        time.sleep(delay)
-                        continue  # Retry with the same key after delay
-                    else:
-                        last_error_response = e.response
-                        break # RPD limit reached, break to try next key
-                
-                app.logger.error(f"Unhandled HTTP Error for key {key_index}: {e}")
-                break # Прерываем retries для текущего ключа
-                if attempt < MAX_RETRIES - 1:
-                    time.sleep(RETRY_DELAY_SECONDS)
-                else:
-                    last_error_response = e.response
 
-            except requests.exceptions.RequestException as e:
-                app.logger.error(f"Ошибка запроса: {e}. Попытка {attempt + 1}/{MAX_RETRIES}")
-                if attempt < MAX_RETRIES - 1:
-                    time.sleep(RETRY_DELAY_SECONDS)
-                else:
-                    last_error_response = (jsonify({"error": str(e)}), 500)
+                return response.content, status_code, response_headers, response_data
+
+            last_error_response = response
+
+            if status_code == 429:
+                delay = handle_rate_limit_error(response, key_index, model_name)
+                if delay is None:
+                    break # RPD limit reached, break to try next key
+                if attempt == MAX_RETRIES - 1:
+                    break # Попытки исчерпаны: переходим к следующему ключу, не дожидаясь retryDelay
+                time.sleep(delay)
+                continue  # Retry with the same key after delay
+
+            if status_code in (500, 503) and attempt < MAX_RETRIES - 1:
+                delay = get_retry_delay(attempt)
+                app.logger.warning(f"Получен статус {status_code}. Повторная попытка через {delay:.1f} сек... (Попытка {attempt + 1}/{MAX_RETRIES})")
+                time.sleep(delay)
+                continue
+
+            app.logger.error(f"Unhandled HTTP Error {status_code} for key #{key_index + 1}")
+            break # Прерываем retries для текущего ключа
         
-    if last_error_response:
+    if last_error_response is not None:
         app.logger.error("Все API ключи были опробованы, возвращается последняя ошибка.")
         if isinstance(last_error_response, tuple):
              return last_error_response
-        # Также оборачиваем ответ с ошибкой в Response
-        headers_dict = {k: v for k, v in last_error_response.headers.items() if k.lower() not in ['transfer-encoding', 'content-encoding']}
-        return Response(last_error_response.content, status=last_error_response.status_code, headers=headers_dict)
+        response_headers = filter_response_headers(last_error_response.headers)
+        return last_error_response.content, last_error_response.status_code, response_headers, None
     
     app.logger.error(f"All API keys have reached their daily limit for model {model_name}.")
-    return jsonify({
+    return orjson.dumps({
         "error": {
             "code": 503,
             "message": f"Service Unavailable: All available API keys have reached their daily usage limit for the requested model ({model_name}). Please try again later.",
             "status": "SERVICE_UNAVAILABLE"
         }
-    }), 503
+    }), 503, JSON_HEADERS, None
+
+# --- Flask Endpoints ---
+
+@app.route('/', methods=['GET'])
+def status_page():
+    """
+    Generates and returns an HTML page with the real-time status of API key usage.
+    """
+    snapshot = snapshot_api_keys()
+    parts = [STATUS_PAGE_HEADER, f"<p><strong>Total Keys Loaded:</strong> {len(snapshot)}</p>"]
+    for i, key_info in enumerate(snapshot):
+        parts.append(f'<div class="key-block"><h2>Key #{i+1}</h2>')
+        if not key_info.get('usage'):
+            parts.append("<p>No usage data yet.</p>")
+        else:
+            for model_name, usage_data in sorted(key_info['usage'].items()):
+                rpd_reached = usage_data.get('rpd_limit_reached', False)
+                parts.append(STATUS_PAGE_MODEL_TEMPLATE.format(
+                    model_name=html.escape(model_name),
+                    token_count=usage_data.get('token_count', 0),
+                    cached_token_count=usage_data.get('cached_token_count', 0),
+                    request_count=usage_data.get('request_count', 0),
+                    rpd_class="rpd-reached" if rpd_reached else "rpd-ok",
+                    rpd_status="Reached" if rpd_reached else "OK",
+                ))
+        parts.append('</div>')
+    parts.append("</body></html>")
+    return "".join(parts)
+
+@app.route('/v1/models', methods=['GET'])
+def list_models():
+    """
+    Provides a list of supported models in the OpenAI format.
+    """
+    return Response(MODELS_RESPONSE_BODY, mimetype='application/json', headers=MODELS_RESPONSE_HEADERS)
+
+@app.route('/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    """
+    Handles OpenAI-compatible chat completion requests.
+    """
+    openai_request = request.json
+    model_name = openai_request.get('model')
+
+    try:
+        gemini_request_data = convert_openai_to_gemini_request(openai_request)
+    except ValueError as e:
+        app.logger.error(f"Invalid request in chat_completions: {e}")
+        return jsonify({"error": str(e)}), 400
+
+    stream = bool(openai_request.get('stream', False))
+
+    content, status_code, _, gemini_response_json = forward_to_gemini(model_name, gemini_request_data, stream=stream)
+    if status_code != 200:
+        error_message = content.decode('utf-8', errors='replace')
+        app.logger.error(f"Error in chat_completions: {error_message}")
+        return jsonify({"error": error_message}), status_code
+
+    if stream:
+        flask_response = Response(generate_openai_stream(content, model_name), mimetype='text/event-stream')
+        flask_response.call_on_close(content.close)
+        return flask_response
+
+    openai_response = convert_gemini_to_openai_response(gemini_response_json, model_name)
+    return jsonify(openai_response)
+
+@app.route('/v1beta/models/<string:model_name>:generateContent', methods=['POST'])
+def proxy_to_gemini(model_name):
+    """
+    Proxies requests to the Google Gemini API, handling key rotation, limits, and retries.
+    """
+    content, status_code, headers, _ = forward_to_gemini(model_name, request.get_json())
+    return Response(content, status=status_code, headers=headers)
+
+@app.route('/v1beta/models/<string:model_name>:streamGenerateContent', methods=['POST'])
+def proxy_stream_to_gemini(model_name):
+    """
+    Proxies streaming requests to Gemini, relaying Server-Sent Events to the client as they arrive.
+    Only the SSE format (alt=sse) is supported; the upstream events and headers are passed through unchanged.
+    """
+    if request.args.get('alt') != 'sse':
+        # Без alt=sse Gemini отдает поток в виде JSON-массива, который прокси не пересылает
+        return Response(orjson.dumps({
+            "error": {
+                "code": 400,
+                "message": "Bad Request: only alt=sse is supported for streamGenerateContent by this proxy.",
+                "status": "INVALID_ARGUMENT"
+            }
+        }), status=400, headers=JSON_HEADERS)
+    content, status_code, headers, _ = forward_to_gemini(model_name, request.get_json(), stream=True)
+    if status_code != 200:
+        return Response(content, status=status_code, headers=headers)
+    events = (line + b'\n\n' for line, _ in content)
+    flask_response = Response(events, status=status_code, headers=headers)
+    flask_response.call_on_close(content.close)
+    return flask_response
 
 # --- Main Execution ---
 
-if __name__ == '__main__':
+def init_proxy():
+    """
+    Loads API keys and starts the background threads.
+    Returns False if no keys could be loaded. Used by both __main__ and wsgi.py.
+    """
+    global api_keys
     api_keys = load_api_keys()
-    if api_keys:
-        reset_thread = threading.Thread(target=reset_rpd_limits_daily, daemon=True)
-        reset_thread.start()
-        print_status_tui()
-        app.run(host='0.0.0.0', port=PORT)
+    if not api_keys:
+        return False
+    reset_thread = threading.Thread(target=reset_rpd_limits_daily, daemon=True)
+    reset_thread.start()
+    persistence_thread = threading.Thread(target=persist_api_keys_periodically, daemon=True)
+    persistence_thread.start()
+    # TUI нужен только в терминале: при выводе в файл или журнал сервиса перерисовки лишь засоряют логи
+    if sys.stdout.isatty():
+        tui_thread = threading.Thread(target=render_status_tui_periodically, daemon=True)
+        tui_thread.start()
+    atexit.register(flush_api_keys)
+    atexit.register(shutdown_event.set)
+    return True
+
+def handle_shutdown_signal(signum, frame):
+    """
+    Stops the background threads and exits, so atexit handlers flush pending changes.
+    """
+    shutdown_event.set()
+    sys.exit(0)
+
+if __name__ == '__main__':
+    if init_proxy():
+        signal.signal(signal.SIGTERM, handle_shutdown_signal)
+        if sys.stdout.isatty():
+            print_status_tui()
+        # Состояние ключей хранится в памяти процесса, поэтому масштабируемся потоками
+        # или гринлетами gevent, а не процессами
+        if USE_GEVENT:
+            from gevent.pywsgi import WSGIServer
+            WSGIServer(('0.0.0.0', PORT), app).serve_forever()
+        else:
+            serve(app, host='0.0.0.0', port=PORT, threads=SERVER_THREADS)
     else:
         app.logger.error("Сервер не может быть запущен из-за ошибки загрузки ключей.")
\ No newline at end of file
@@ -48,7 +48,205 @@ def test_chat_completions():
     except Exception as e:
         print(f"❌ test_chat_completions: FAILED - {e}")
 
+def test_chat_completions_stream():
+    """Tests the streaming mode of the /v1/chat/completions endpoint."""
+    print("--- Running test_chat_completions_stream ---")
+    try:
+        payload = {
+            "model": "gemini-2.5-flash",
+            "stream": True,
+            "messages": [
+                {"role": "user", "content": "Hello, what is the capital of France?"}
+            ]
+        }
+        response = requests.post(PROXY_URL + "/v1/chat/completions", json=payload, stream=True)
+
+        assert response.status_code == 200, f"Expected status code 200, but got {response.status_code}"
+        assert response.headers["Content-Type"].startswith("text/event-stream"), "Response is not an event stream"
+        events = [line for line in response.iter_lines() if line.startswith(b"data: ")]
+        assert events and events[-1] == b"data: [DONE]", "Stream does not end with '[DONE]'"
+        content = "".join(
+            choice["delta"].get("content", "")
+            for event in events[:-1]
+            for choice in json.loads(event[6:])["choices"]
+        )
+        assert "Paris" in content, "Streamed message does not contain 'Paris'"
+        print("✅ test_chat_completions_stream: PASSED")
+    except Exception as e:
+        print(f"❌ test_chat_completions_stream: FAILED - {e}")
+
+def test_unsupported_model():
+    """Tests that an unsupported model is rejected with 404 without calling Gemini."""
+    print("--- Running test_unsupported_model ---")
+    try:
+        payload = {
+            "model": "gemini-no-such-model",
+            "messages": [
+                {"role": "user", "content": "Hello"}
+            ]
+        }
+        response = requests.post(PROXY_URL + "/v1/chat/completions", json=payload)
+
+        assert response.status_code == 404, f"Expected status code 404, but got {response.status_code}"
+        assert "gemini-no-such-model" in response.json()["error"], "Error message does not name the unsupported model"
+        print("✅ test_unsupported_model: PASSED")
+    except Exception as e:
+        print(f"❌ test_unsupported_model: FAILED - {e}")
+
+def make_rate_limit_response(quota_id):
+    """Builds a 429 response shaped like the ones Gemini returns for exhausted quotas."""
+    response = requests.Response()
+    response.status_code = 429
+    response._content = json.dumps({
+        "error": {
+            "code": 429,
+            "message": "You exceeded your current quota, please check your plan and billing details.",
+            "status": "RESOURCE_EXHAUSTED",
+            "details": [
+                {
+                    "@type": "type.googleapis.com/google.rpc.QuotaFailure",
+                    "violations": [{
+                        "quotaMetric": "generativelanguage.googleapis.com/generate_content_free_tier_requests",
+                        "quotaId": quota_id,
+                        "quotaDimensions": {"location": "global", "model": "gemini-2.5-pro"},
+                        "quotaValue": "100"
+                    }]
+                },
+                {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "38s"}
+            ]
+        }
+    }).encode()
+    return response
+
+def test_rate_limit_error_parsing():
+    """Tests that daily and per-minute 429 errors are told apart (runs in-process, no server needed)."""
+    print("--- Running test_rate_limit_error_parsing ---")
+    try:
+        import threading
+        import proxy_server
+
+        key_info = {"_lock": threading.Lock(), "usage": {"gemini-2.5-pro": proxy_server.new_model_usage()}}
+        proxy_server.api_keys = [key_info]
+
+        delay = proxy_server.handle_rate_limit_error(
+            make_rate_limit_response("GenerateRequestsPerMinutePerProjectPerModel-FreeTier"), 0, "gemini-2.5-pro")
+        assert delay == 38.0, f"Expected retryDelay 38.0 for the per-minute limit, but got {delay}"
+        assert not key_info["usage"]["gemini-2.5-pro"]["rpd_limit_reached"], "Per-minute limit marked the key as RPD-exhausted"
+
+        delay = proxy_server.handle_rate_limit_error(
+            make_rate_limit_response("GenerateRequestsPerDayPerProjectPerModel-FreeTier"), 0, "gemini-2.5-pro")
+        assert delay is None, f"Expected no retry for the daily limit, but got delay {delay}"
+        assert key_info["usage"]["gemini-2.5-pro"]["rpd_limit_reached"], "Daily limit did not mark the key as RPD-exhausted"
+        print("✅ test_rate_limit_error_parsing: PASSED")
+    except Exception as e:
+        print(f"❌ test_rate_limit_error_parsing: FAILED - {e}")
+
+def test_message_content_conversion():
+    """Tests conversion of OpenAI message content parts to Gemini parts (runs in-process, no server needed)."""
+    print("--- Running test_message_content_conversion ---")
+    try:
+        import proxy_server
+
+        parts = proxy_server.convert_message_content_to_parts([
+            {"type": "text", "text": "What is in this picture?"},
+            {"type": "image_url", "image_url": {"url": "data:image/png;base64,iVBORw0KGgo="}},
+            {"type": "input_audio", "input_audio": {"data": "UklGRg==", "format": "wav"}},
+        ])
+        assert parts == [
+            {"text": "What is in this picture?"},
+            {"inline_data": {"mime_type": "image/png", "data": "iVBORw0KGgo="}},
+            {"inline_data": {"mime_type": "audio/wav", "data": "UklGRg=="}},
+        ], f"Unexpected Gemini parts: {parts}"
+
+        rejected_contents = {
+            "external image URL": [{"type": "image_url", "image_url": {"url": "https://example.com/cat.png"}}],
+            "unknown part type": [{"type": "file", "file": {"file_id": "file-123"}}],
+            "empty parts list": [],
+        }
+        for case, content in rejected_contents.items():
+            try:
+                proxy_server.convert_message_content_to_parts(content)
+            except ValueError:
+                continue
+            raise AssertionError(f"Content with {case} was not rejected")
+
+        try:
+            proxy_server.convert_openai_to_gemini_request({"messages": [
+                {"role": "system", "content": [{"type": "image_url", "image_url": {"url": "data:image/png;base64,iVBORw0KGgo="}}]},
+                {"role": "user", "content": "Hello"},
+            ]})
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("System message with non-text content was not rejected")
+        print("✅ test_message_content_conversion: PASSED")
+    except Exception as e:
+        print(f"❌ test_message_content_conversion: FAILED - {e}")
+
+def test_rate_limited_key_deferral():
+    """Tests that a key at its RPM limit is skipped for a free one, and waited on only when all keys are saturated (runs in-process, no server needed)."""
+    print("--- Running test_rate_limited_key_deferral ---")
+    try:
+        import threading
+        import time
+        import proxy_server
+
+        model_name = "gemini-2.5-flash"
+        period = 0.5
+        proxy_server.api_keys = [
+            {
+                "key": key,
+                "usage": {model_name: proxy_server.new_model_usage()},
+                "_lock": threading.Lock(),
+                "_headers": {"x-goog-api-key": key},
+                "_rate_limiters": {model_name: proxy_server.RateLimiter(1, period)},
+            } for key in ("saturated-key", "free-key")
+        ]
+        proxy_server.available_keys.clear()
+
+        used_keys = []
+        def post_to_gemini(url, headers, **kwargs):
+            # Ответ Gemini подменяется, чтобы тест не обращался к сети и не расходовал ключи
+            used_keys.append(headers["x-goog-api-key"])
+            response = requests.Response()
+            response.status_code = 200
+            response._content = b'{"usageMetadata": {"totalTokenCount": 1}}'
+            return response
+        proxy_server.http_session.post = post_to_gemini
+
+        try:
+            limiter = proxy_server.RateLimiter(1, period)
+            assert limiter.try_acquire(), "try_acquire failed on an empty window"
+            assert not limiter.try_acquire(), "try_acquire succeeded on a full window"
+
+            # Первый ключ исчерпал RPM лимит: запрос должен сразу уйти на второй
+            assert proxy_server.api_keys[0]["_rate_limiters"][model_name].try_acquire()
+            started = time.monotonic()
+            _, status_code, _, _ = proxy_server.forward_to_gemini(model_name, {})
+            elapsed = time.monotonic() - started
+            assert status_code == 200, f"Expected status code 200, but got {status_code}"
+            assert used_keys == ["free-key"], f"Expected the free key to be used, but got {used_keys}"
+            assert elapsed < period / 2, f"Request waited {elapsed:.2f}s although a key was free"
+
+            # Теперь лимит исчерпан у обоих ключей: запрос должен дождаться освобождения слота
+            started = time.monotonic()
+            _, status_code, _, _ = proxy_server.forward_to_gemini(model_name, {})
+            elapsed = time.monotonic() - started
+            assert status_code == 200, f"Expected status code 200, but got {status_code}"
+            assert len(used_keys) == 2, f"Expected exactly one more upstream call, but got {used_keys}"
+            assert elapsed >= period / 2, f"Request did not wait ({elapsed:.2f}s) although all keys were saturated"
+        finally:
+            del proxy_server.http_session.post
+        print("✅ test_rate_limited_key_deferral: PASSED")
+    except Exception as e:
+        print(f"❌ test_rate_limited_key_deferral: FAILED - {e}")
+
 if __name__ == "__main__":
     test_status_page()
     test_models_endpoint()
-    test_chat_completions()
\ No newline at end of file
+    test_chat_completions()
+    test_chat_completions_stream()
+    test_unsupported_model()
+    test_rate_limit_error_parsing()
+    test_message_content_conversion()
+    test_rate_limited_key_deferral()
\ No newline at end of file
@@ -0,0 +1,16 @@
+"""
+WSGI entry point for running the proxy under a production server, for example:
+
+    waitress-serve --listen=0.0.0.0:8080 --threads=32 wsgi:app
+    gunicorn -k gthread -w 1 --threads 32 -b 0.0.0.0:8080 wsgi:app
+    gunicorn -k gevent -w 1 --worker-connections 1000 -b 0.0.0.0:8080 wsgi:app
+
+Key usage is kept in process memory, so always run a single worker process
+and scale with threads or gevent connections. The gevent worker monkey-patches
+requests, time.sleep and threading before the app is imported, so the proxy
+code runs unchanged on greenlets.
+"""
+from proxy_server import app, init_proxy
+
+if not init_proxy():
+    raise RuntimeError("Сервер не может быть запущен из-за ошибки загрузки ключей.")